@@ -1,10 +1,18 @@
 import streamlit as st
-import google.generativeai as genai
-import json
+import orjson
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 import random
 import io
+import hashlib
+import uuid
+from collections import deque
+
+# Copy-on-Write lets assign() share unmodified columns instead of deep-copying
+# (always on, and the option deprecated, from pandas 3.0)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
 
 # Page config
@@ -14,23 +22,133 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize session state
+MAX_MESSAGES = 50
+RECENT_TASKS = 5
+
+# Initialize session state (histories are bounded so reruns don't re-render everything)
 if "messages" not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.messages = deque(maxlen=MAX_MESSAGES)
 if "workflows" not in st.session_state:
     st.session_state.workflows = []
 if "task_history" not in st.session_state:
-    st.session_state.task_history = []
+    st.session_state.task_history = deque(maxlen=RECENT_TASKS)
 if "uploaded_df" not in st.session_state:
     st.session_state.uploaded_df = None
 if "uploaded_filename" not in st.session_state:
     st.session_state.uploaded_filename = None
+if "uploaded_file_id" not in st.session_state:
+    st.session_state.uploaded_file_id = None
+
 
+GEMINI_MODEL = 'gemini-1.5-flash'
 
-# Configure Gemini
+
+# Configure Gemini (cached per API key so the client is built once and reused across turns;
+# each client carries its own key, so sessions with different keys never share SDK state)
+@st.cache_resource(show_spinner=False)
 def configure_gemini(api_key):
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-1.5-flash')
+    from google import genai
+
+    return genai.Client(api_key=api_key)
+
+
+LARGE_CSV_BYTES = 100 * 1024 * 1024
+CSV_CHUNK_ROWS = 50_000
+PREVIEW_ROWS = 10
+HISTORY_ROWS = 200
+DATAFRAME_HEIGHT = 400
+EXCEL_MAX_ROWS = 1_048_576  # includes the header row
+
+
+# Memory reduction: downcast numeric columns and categorize repetitive strings
+def reduce_mem_usage(df, numeric=True, categorize=True):
+    start_mem = df.memory_usage(deep=True).sum() / 1024 ** 2
+
+    for col in df.columns:
+        col_type = df[col].dtype
+        arrow = isinstance(col_type, pd.ArrowDtype)
+
+        if not numeric and not pd.api.types.is_string_dtype(col_type):
+            continue
+
+        if pd.api.types.is_integer_dtype(col_type):
+            c_min, c_max = df[col].min(), df[col].max()
+            if pd.isna(c_min):
+                continue
+            for int_type in (np.int8, np.int16, np.int32):
+                if np.iinfo(int_type).min <= c_min and c_max <= np.iinfo(int_type).max:
+                    df[col] = df[col].astype(f"{np.dtype(int_type).name}[pyarrow]" if arrow else int_type)
+                    break
+
+        elif pd.api.types.is_float_dtype(col_type):
+            # Only downcast when every value survives the float32 round-trip unchanged
+            values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            if np.array_equal(values, values.astype(np.float32).astype(np.float64), equal_nan=True):
+                df[col] = df[col].astype("float32[pyarrow]" if arrow else np.float32)
+
+        elif categorize and pd.api.types.is_string_dtype(col_type) and len(df) > 0:
+            if df[col].nunique() / len(df) < 0.5:
+                df[col] = df[col].astype('category')
+
+    end_mem = df.memory_usage(deep=True).sum() / 1024 ** 2
+    df.attrs["mem_saved_mb"] = start_mem - end_mem
+    return df
+
+
+# File parsing (cached on file name + bytes so reruns reuse the parsed, downcast DataFrame)
+@st.cache_data(show_spinner=False, max_entries=4)
+def _parse_bytes_cached(name, data):
+    return _parse_bytes(name, data)
+
+
+def _parse_bytes(name, data):
+    if name.endswith('.csv') and len(data) > LARGE_CSV_BYTES:
+        # Downcast chunk by chunk to bound peak memory on very large CSVs
+        try:
+            return _read_csv_chunked(data)
+        except UnicodeDecodeError:
+            return _read_csv_chunked(data, encoding='latin-1')
+
+    return reduce_mem_usage(_read_bytes(name, data))
+
+
+def _read_csv_chunked(data, encoding=None):
+    chunks = pd.read_csv(io.BytesIO(data), chunksize=CSV_CHUNK_ROWS, encoding=encoding, dtype_backend='pyarrow')
+    # Numerics are downcast per chunk; strings are categorized once after concat so
+    # every chunk shares one category set instead of concat falling back to strings
+    parts = [reduce_mem_usage(c, categorize=False) for c in chunks]
+    saved_mb = sum(p.attrs["mem_saved_mb"] for p in parts)
+
+    df = reduce_mem_usage(pd.concat(parts, ignore_index=True), numeric=False)
+    df.attrs["mem_saved_mb"] += saved_mb
+    return df
+
+
+def _read_bytes(name, data):
+    if name.endswith('.csv'):
+        try:
+            import polars as pl
+            return pl.read_csv(data).to_pandas(use_pyarrow_extension_array=True)
+        except Exception:
+            # Polars missing, or strict about encodings/ragged rows; fall back to pandas
+            pass
+
+        try:
+            return pd.read_csv(io.BytesIO(data), dtype_backend='pyarrow')
+        except UnicodeDecodeError:
+            return pd.read_csv(io.BytesIO(data), encoding='latin-1', dtype_backend='pyarrow')
+
+    return _read_excel(io.BytesIO(data), name, dtype_backend='pyarrow')
+
+
+def _read_excel(source, name, **kwargs):
+    if name.endswith('.xlsx'):
+        try:
+            return pd.read_excel(source, engine='calamine', **kwargs)
+        except ImportError:
+            return pd.read_excel(source, engine='openpyxl', **kwargs)
+
+    return pd.read_excel(source, engine='xlrd', **kwargs)
 
 
 # File reading function
@@ -38,50 +156,145 @@ def read_uploaded_file(uploaded_file):
     try:
         file_name = uploaded_file.name.lower()
 
+        if not file_name.endswith(('.csv', '.xlsx', '.xls')):
+            return None, "Unsupported file format. Please upload CSV, XLSX, or XLS."
+
+        data = uploaded_file.getvalue()
+        # Large files skip the cache: st.cache_data keeps a pickled copy next to the
+        # returned frame, doubling peak memory; the result lives in session_state anyway
+        parse = _parse_bytes if len(data) > LARGE_CSV_BYTES else _parse_bytes_cached
+        df = parse(file_name, data)
+        return df, None
+
+    except Exception as e:
+        return None, f"Error reading file: {str(e)}"
+
+
+# Classification only: long markdown inside a JSON string can't be streamed and often
+# breaks escaping, so reports/outlines/answers are generated by a separate streamed call
+_INTENT_PROMPT = """Classify: "{q}"
+Return JSON {{task_type, action, parameters, description}}.
+task_type ∈ [sheet_update, report_generation, presentation_creation, hr_workflow, sales_task, finance_task, general]
+"""
+
+
+# Intent parsing (cached per API key so repeated requests skip the Gemini round-trip;
+# _client is excluded from hashing and key_id scopes results to the session's key)
+@st.cache_data(ttl=3600, show_spinner=False)
+def _parse_intent_cached(user_input, key_id, _client):
+    prompt = _INTENT_PROMPT.format(q=user_input)
+
+    response = _client.models.generate_content(
+        model=GEMINI_MODEL,
+        contents=prompt,
+        config={"response_mime_type": "application/json"}
+    )
+
+    # Strip a stray fence around the JSON; parse failures raise
+    # (orjson.JSONDecodeError is a ValueError) so they aren't cached
+    clean = (response.text or "").strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+    return orjson.loads(clean.encode())
+
+
+# File preview function (reads only the first rows so large files display instantly)
+def read_file_preview(uploaded_file, nrows=PREVIEW_ROWS):
+    try:
+        file_name = uploaded_file.name.lower()
+        # Read straight from the upload rather than copying its bytes
+        uploaded_file.seek(0)
+
         if file_name.endswith('.csv'):
             try:
-                df = pd.read_csv(uploaded_file)
+                return pd.read_csv(uploaded_file, nrows=nrows), None
             except UnicodeDecodeError:
                 uploaded_file.seek(0)
-                df = pd.read_csv(uploaded_file, encoding='latin-1')
+                return pd.read_csv(uploaded_file, nrows=nrows, encoding='latin-1'), None
 
-        elif file_name.endswith('.xlsx'):
-            df = pd.read_excel(uploaded_file, engine='openpyxl')
+        elif file_name.endswith(('.xlsx', '.xls')):
+            return _read_excel(uploaded_file, file_name, nrows=nrows), None
 
-        elif file_name.endswith('.xls'):
-            df = pd.read_excel(uploaded_file, engine='xlrd')
-
-        else:
-            return None, "Unsupported file format. Please upload CSV, XLSX, or XLS."
-
-        return df, None
+        return None, "Unsupported file format. Please upload CSV, XLSX, or XLS."
 
     except Exception as e:
         return None, f"Error reading file: {str(e)}"
 
 
+# Excel export (xlsxwriter is considerably faster than openpyxl for writing)
+def to_excel_bytes(df):
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False)
+    return buffer.getvalue()
+
+
+# Table preview plus full-table downloads for a chat message
+def render_table(msg):
+    st.dataframe(msg["data"], width="stretch", height=DATAFRAME_HEIGHT)
+
+    full_data, name = msg.get("full_data"), msg["name"]
+    if full_data is None:
+        st.caption("Full-table downloads are kept for the latest table only.")
+        return
+
+    # Files are built only when clicked, and clicking doesn't rerun the app
+    st.download_button(
+        "Download full table (CSV)",
+        lambda: full_data.to_csv(index=False),
+        file_name=f"{name}.csv",
+        mime="text/csv",
+        key=f"{msg['id']}_csv",
+        on_click="ignore"
+    )
+    if len(full_data) >= EXCEL_MAX_ROWS:
+        st.caption("Table exceeds Excel's row limit; use the CSV download.")
+    else:
+        st.download_button(
+            "Download full table (Excel)",
+            lambda: to_excel_bytes(full_data),
+            file_name=f"{name}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            key=f"{msg['id']}_xlsx",
+            on_click="ignore"
+        )
+
+
 # TASK EXECUTION FUNCTIONS
 class AutomationAgent:
-    def __init__(self, model):
-        self.model = model
+    _HR_WORKFLOWS = {
+        "onboarding": [
+            "Create employee profile",
+            "Generate welcome email",
+            "Setup system accounts",
+            "Schedule orientation",
+            "Assign mentor",
+            "Create training plan"
+        ],
+        "offboarding": [
+            "Initiate exit process",
+            "Schedule exit interview",
+            "Revoke system access",
+            "Process final payroll",
+            "Transfer knowledge docs",
+            "Update org chart"
+        ],
+        "leave_request": [
+            "Validate leave balance",
+            "Check team coverage",
+            "Notify manager",
+            "Update calendar",
+            "Adjust workload"
+        ]
+    }
+
+    def __init__(self, client, key_id):
+        self.client = client
+        self.key_id = key_id
 
     def parse_intent(self, user_input):
-        prompt = f"""Analyze this automation request and extract structured information.
-Request: "{user_input}"
-
-Return a JSON object with:
-- task_type: one of [sheet_update, report_generation, presentation_creation, hr_workflow, sales_task, finance_task]
-- action: specific action to perform
-- parameters: dict of relevant parameters
-- description: brief description of what will be done
-"""
-
-        response = self.model.generate_content(prompt)
-
         try:
-            clean = response.text.strip().replace("```json", "").replace("```", "")
-            return json.loads(clean)
-        except:
+            return _parse_intent_cached(user_input, self.key_id, self.client)
+        except ValueError:
+            # Malformed JSON, or no text on a blocked response
             return {
                 "task_type": "general",
                 "action": "process",
@@ -91,22 +304,17 @@ Return a JSON object with:
 
     def execute_sheet_update(self, params, uploaded_df=None):
         if uploaded_df is not None:
-            df = uploaded_df.copy()
-            df["Last_Updated"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            df = uploaded_df.assign(Last_Updated=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
             return df, f"Processed uploaded sheet: {len(df)} rows, {len(df.columns)} columns"
 
         rows = params.get("rows", random.randint(10, 100))
         cols = params.get("columns", ["Name", "Value", "Status", "Date"])
 
-        data = {
-            col: [
-                f"Data_{i}" if col != "Date" else datetime.now().strftime("%Y-%m-%d")
-                for i in range(rows)
-            ]
-            for col in cols
-        }
+        today_str = datetime.now().strftime("%Y-%m-%d")
+        data_arr = np.char.add("Data_", np.arange(rows).astype(str))
+        date_arr = np.full(rows, today_str)
 
-        df = pd.DataFrame(data)
+        df = pd.DataFrame({col: date_arr if col == "Date" else data_arr for col in cols})
         return df, f"Generated {rows} rows across {len(cols)} columns"
 
     def generate_report(self, params):
@@ -121,8 +329,7 @@ Return a JSON object with:
 Format in markdown.
 """
 
-        response = self.model.generate_content(prompt)
-        return response.text
+        return self.client.models.generate_content_stream(model=GEMINI_MODEL, contents=prompt)
 
     def create_presentation_outline(self, params):
         topic = params.get("topic", "Business Review")
@@ -135,70 +342,57 @@ For each slide include:
 - Speaker notes (1–2 sentences)
 """
 
-        response = self.model.generate_content(prompt)
-        return response.text
+        return self.client.models.generate_content_stream(model=GEMINI_MODEL, contents=prompt)
+
+    def general_response(self, user_input):
+        return self.client.models.generate_content_stream(model=GEMINI_MODEL, contents=user_input)
 
     def hr_workflow(self, params):
         workflow_type = params.get("workflow", "onboarding")
-
-        workflows = {
-            "onboarding": [
-                "Create employee profile",
-                "Generate welcome email",
-                "Setup system accounts",
-                "Schedule orientation",
-                "Assign mentor",
-                "Create training plan"
-            ],
-            "offboarding": [
-                "Initiate exit process",
-                "Schedule exit interview",
-                "Revoke system access",
-                "Process final payroll",
-                "Transfer knowledge docs",
-                "Update org chart"
-            ],
-            "leave_request": [
-                "Validate leave balance",
-                "Check team coverage",
-                "Notify manager",
-                "Update calendar",
-                "Adjust workload"
-            ]
-        }
-
-        return workflows.get(workflow_type, workflows["onboarding"])
+        return self._HR_WORKFLOWS.get(workflow_type, self._HR_WORKFLOWS["onboarding"])
 
     def sales_automation(self, params):
+        rng = np.random.default_rng()
+        close_dates = pd.Timestamp.now().normalize() + pd.to_timedelta(rng.integers(7, 90, 10, endpoint=True), unit="D")
+
         data = pd.DataFrame({
             "Lead": [f"Company_{i}" for i in range(1, 11)],
-            "Stage": random.choices(["Prospect", "Qualified", "Proposal", "Negotiation", "Closed"], k=10),
-            "Value": [random.randint(10000, 100000) for _ in range(10)],
-            "Probability": [random.randint(10, 90) for _ in range(10)],
-            "Expected Close": [
-                (datetime.now() + timedelta(days=random.randint(7, 90))).strftime("%Y-%m-%d")
-                for _ in range(10)
-            ]
+            "Stage": rng.choice(["Prospect", "Qualified", "Proposal", "Negotiation", "Closed"], 10),
+            "Value": rng.integers(10000, 100000, 10, endpoint=True),
+            "Probability": rng.integers(10, 90, 10, endpoint=True),
+            "Expected Close": close_dates.strftime("%Y-%m-%d")
         })
         return data
 
     def finance_task(self, params):
+        rng = np.random.default_rng()
         df = pd.DataFrame({
             "Category": ["Travel", "Software", "Marketing", "Office", "Utilities"],
             "Budget": [50000, 30000, 75000, 20000, 15000],
-            "Actual": [
-                random.randint(40000, 55000),
-                random.randint(25000, 35000),
-                random.randint(60000, 80000),
-                random.randint(15000, 25000),
-                random.randint(12000, 18000)
-            ]
+            "Actual": rng.integers(
+                [40000, 25000, 60000, 15000, 12000],
+                [55000, 35000, 80000, 25000, 18000],
+                endpoint=True
+            )
         })
 
         df["Variance"] = df["Budget"] - df["Actual"]
         return df
 
 
+# Yield text from a streamed Gemini response for st.write_stream
+def stream_text(response):
+    for chunk in response:
+        yield chunk.text or ""
+
+
+# Cached agent: one AutomationAgent per API key
+@st.cache_resource(show_spinner=False)
+def get_agent(api_key):
+    key_id = hashlib.sha256(api_key.encode()).hexdigest()
+    return AutomationAgent(configure_gemini(api_key), key_id)
+
+
 # ---- SIDEBAR ----
 with st.sidebar:
     st.title("⚙️ Configuration")
@@ -207,7 +401,7 @@ with st.sidebar:
     st.divider()
     st.subheader("📋 Recent Tasks")
     if st.session_state.task_history:
-        for t in st.session_state.task_history[-5:]:
+        for t in st.session_state.task_history:
             st.caption(f"✔ {t['name']} — {t['time']}")
     else:
         st.caption("No tasks yet")
@@ -219,27 +413,47 @@ st.caption("Automate HR • Sales • Finance • Reporting • Sheets")
 
 
 # ---------- FILE UPLOADER ----------
-st.subheader("📁 Upload Spreadsheet")
+# Runs as a fragment so uploader and button interactions rerun only this panel
+@st.fragment
+def upload_panel():
+    st.subheader("📁 Upload Spreadsheet")
 
-uploaded_file = st.file_uploader(
-    "Upload CSV or Excel",
-    type=["csv", "xlsx", "xls"]
-)
+    uploaded_file = st.file_uploader(
+        "Upload CSV or Excel",
+        type=["csv", "xlsx", "xls"]
+    )
+
+    if uploaded_file:
+        if st.session_state.uploaded_file_id != uploaded_file.file_id:
+            st.session_state.uploaded_df = None
+
+            preview, error = read_file_preview(uploaded_file)
+            if error:
+                st.error(error)
+            else:
+                preview_slot = st.empty()
+                preview_slot.dataframe(preview, width="stretch")
+
+                if st.button("Load entire file for processing"):
+                    df, error = read_uploaded_file(uploaded_file)
+                    if error:
+                        st.error(error)
+                    else:
+                        st.session_state.uploaded_df = df
+                        st.session_state.uploaded_filename = uploaded_file.name
+                        st.session_state.uploaded_file_id = uploaded_file.file_id
+                        # The loaded frame's head replaces the preview below
+                        preview_slot.empty()
+                        st.success(f"Loaded: {uploaded_file.name}")
+                        st.caption(f"Memory saved by dtype downcasting: {df.attrs.get('mem_saved_mb', 0):.2f} MB")
+
+        if st.session_state.uploaded_df is not None:
+            df = st.session_state.uploaded_df
 
-if uploaded_file:
-    if st.session_state.uploaded_filename != uploaded_file.name:
-        df, error = read_uploaded_file(uploaded_file)
-        if error:
-            st.error(error)
-        else:
-            st.session_state.uploaded_df = df
-            st.session_state.uploaded_filename = uploaded_file.name
-            st.success(f"Loaded: {uploaded_file.name}")
+            st.dataframe(df.head(), width="stretch")
 
-    if st.session_state.uploaded_df is not None:
-        df = st.session_state.uploaded_df
 
-        st.dataframe(df.head(), use_container_width=True)
+upload_panel()
 
 
 # ---------- CHAT INTERFACE ----------
@@ -248,6 +462,8 @@ st.subheader("💬 Automation Chat")
 for msg in st.session_state.messages:
     with st.chat_message(msg["role"]):
         st.markdown(msg["content"])
+        if msg.get("data") is not None:
+            render_table(msg)
 
 user_input = st.chat_input("Describe a task...")
 
@@ -259,55 +475,55 @@ if user_input:
 
         with st.chat_message("assistant"):
             with st.spinner("Processing..."):
-                model = configure_gemini(api_key)
-                agent = AutomationAgent(model)
+                agent = get_agent(api_key)
 
                 intent = agent.parse_intent(user_input)
 
-                st.markdown(f"**Task:** {intent['task_type']}")
-                st.markdown(f"**Action:** {intent['description']}")
-
-                result = ""
-                data = None
-
-                if intent["task_type"] == "sheet_update":
-                    df, msg = agent.execute_sheet_update(intent["parameters"], st.session_state.uploaded_df)
-                    st.dataframe(df)
-                    result = msg
-
-                elif intent["task_type"] == "report_generation":
-                    result = agent.generate_report(intent["parameters"])
-                    st.markdown(result)
-
-                elif intent["task_type"] == "presentation_creation":
-                    result = agent.create_presentation_outline(intent["parameters"])
-                    st.markdown(result)
-
-                elif intent["task_type"] == "hr_workflow":
-                    steps = agent.hr_workflow(intent["parameters"])
-                    result = "\n".join([f"✔ {s}" for s in steps])
-                    st.markdown(result)
-
-                elif intent["task_type"] == "sales_task":
-                    df = agent.sales_automation(intent["parameters"])
-                    st.dataframe(df)
-                    result = "Generated Sales Pipeline"
-
-                elif intent["task_type"] == "finance_task":
-                    df = agent.finance_task(intent["parameters"])
-                    st.dataframe(df)
-                    result = "Generated Finance Report"
-
-                else:
-                    resp = model.generate_content(user_input)
-                    result = resp.text
-                    st.markdown(result)
-
-                st.session_state.messages.append({"role": "assistant", "content": result})
-                st.session_state.task_history.append({
-                    "name": intent["task_type"],
-                    "time": datetime.now().strftime("%H:%M")
-                })
+            st.markdown(f"**Task:** {intent['task_type']}")
+            st.markdown(f"**Action:** {intent['description']}")
+
+            result = ""
+            data = None
+
+            if intent["task_type"] == "sheet_update":
+                data, result = agent.execute_sheet_update(intent["parameters"], st.session_state.uploaded_df)
+
+            elif intent["task_type"] == "report_generation":
+                result = st.write_stream(stream_text(agent.generate_report(intent["parameters"])))
+
+            elif intent["task_type"] == "presentation_creation":
+                result = st.write_stream(stream_text(agent.create_presentation_outline(intent["parameters"])))
+
+            elif intent["task_type"] == "hr_workflow":
+                steps = agent.hr_workflow(intent["parameters"])
+                result = "\n".join([f"✔ {s}" for s in steps])
+                st.markdown(result)
+
+            elif intent["task_type"] == "sales_task":
+                data = agent.sales_automation(intent["parameters"])
+                result = "Generated Sales Pipeline"
+
+            elif intent["task_type"] == "finance_task":
+                data = agent.finance_task(intent["parameters"])
+                result = "Generated Finance Report"
+
+            else:
+                result = st.write_stream(stream_text(agent.general_response(user_input)))
+
+            msg_data = {"role": "assistant", "content": result, "id": uuid.uuid4().hex}
+            if data is not None:
+                # History keeps previews only; the full table is held for the latest one
+                for old in st.session_state.messages:
+                    old.pop("full_data", None)
+                msg_data["data"] = data.head(HISTORY_ROWS)
+                msg_data["full_data"] = data
+                msg_data["name"] = intent["task_type"]
+                render_table(msg_data)
+            st.session_state.messages.append(msg_data)
+            st.session_state.task_history.append({
+                "name": intent["task_type"],
+                "time": datetime.now().strftime("%H:%M")
+            })
 
 
 # FOOTER